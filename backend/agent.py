@@ -8,14 +8,36 @@ Creates a pandas DataFrame agent using Groq LLM that can:
 """
 
 import io
+import os
+import re
+import json
 import base64
+import asyncio
+import threading
+import collections
+from pathlib import Path
+
+import numpy as np
 import matplotlib
 matplotlib.use('Agg')  # Non-interactive backend for server use
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Pillow gives a much faster encoder than matplotlib's PNG writer;
+# fall back to savefig if it's somehow absent
+try:
+    from PIL import Image
+except ModuleNotFoundError:
+    Image = None
 
 from langchain_groq import ChatGroq
+from langchain_core.callbacks import BaseCallbackHandler
 from langchain_experimental.agents.agent_toolkits import create_pandas_dataframe_agent
 
+from backend.semantic_cache import SemanticCache
+from backend.fast_kernels import grouped_mean_i8, warmup as warmup_kernels
+
 # AgentType import — handle different langchain versions
 try:
     from langchain.agents.agent_types import AgentType
@@ -45,18 +67,18 @@ RULES you MUST follow:
 1. ALWAYS use the existing DataFrame `df` — never create new DataFrames from scratch.
 2. Use ONLY the exact column names listed above.
 3. ALWAYS execute Python code to compute the answer — never guess or make up numbers.
-4. For visualizations: use `matplotlib.pyplot` directly — do NOT use seaborn.
+4. For visualizations: call `chart_ax()` (already available, no import needed)
+   to get a matplotlib axes and draw on it — do NOT use seaborn and do NOT
+   call `plt.figure()` or `plt.show()`.
    - Always do the full chart in ONE single code block.
    - Example for a bar chart:
      ```python
-     import matplotlib.pyplot as plt
      data = df.groupby('Sex')['Survived'].mean()
-     plt.figure(figsize=(8, 5))
-     plt.bar(data.index, data.values, color=['steelblue', 'salmon'])
-     plt.title('Survival Rate by Gender')
-     plt.xlabel('Gender')
-     plt.ylabel('Survival Rate')
-     plt.tight_layout()
+     ax = chart_ax()
+     ax.bar(data.index, data.values, color=['steelblue', 'salmon'])
+     ax.set_title('Survival Rate by Gender')
+     ax.set_xlabel('Gender')
+     ax.set_ylabel('Survival Rate')
      ```
 5. Complete the entire task in as few code executions as possible — ideally ONE.
 6. When computing percentages, round to 2 decimal places.
@@ -64,7 +86,342 @@ RULES you MUST follow:
 """
 
 
-def create_agent(df):
+# ─── Semantic Cache ───────────────────────────────────────────────
+# Checked before every agent invocation: exact + paraphrase hits skip
+# the Groq ReAct loop entirely. Persists across restarts.
+
+_CACHE = SemanticCache(Path(__file__).parent / "data" / ".semantic_cache")
+
+# ─── Exact-match memo ─────────────────────────────────────────────
+# Rung-0 cache in front of everything: "Clear Chat" and page reloads
+# replay questions verbatim. Unlike the semantic cache's exact layer
+# this normalizes the key, is LRU-bounded, and costs one dict lookup.
+
+_EXACT = collections.OrderedDict()  # normalized question → response dict
+_EXACT_MAX = 128
+_EXACT_LOCK = threading.Lock()
+
+
+def _exact_get(question: str):
+    """LRU lookup; returns a shallow copy of the stored response or None."""
+    key = question.strip().lower()
+    with _EXACT_LOCK:
+        entry = _EXACT.get(key)
+        if entry is None:
+            return None
+        _EXACT.move_to_end(key)
+        # Copy the dict; sharing the image bytes is fine (immutable)
+        return dict(entry)
+
+
+def _exact_put(question: str, response: dict) -> None:
+    """Insert/refresh a memo entry, evicting the least recently used."""
+    key = question.strip().lower()
+    with _EXACT_LOCK:
+        _EXACT[key] = dict(response)
+        _EXACT.move_to_end(key)
+        while len(_EXACT) > _EXACT_MAX:
+            _EXACT.popitem(last=False)
+
+
+def _is_cacheable(answer_text: str) -> bool:
+    """
+    True when an answer is worth replaying from the caches.
+
+    AgentExecutor reports hitting max_iterations/max_execution_time by
+    RETURNING its stock stopped message, not by raising — caching that
+    would permanently answer the question (and every paraphrase within
+    the similarity radius) with a transient failure.
+    """
+    return not answer_text.startswith("Agent stopped due to")
+
+
+# Reused buffer for plot capture — avoids a fresh BytesIO allocation
+# (and its growth reallocations) on every chart query. Lock-guarded now
+# that per-request figures let encodes run from concurrent threads.
+_PLOT_BUF = io.BytesIO()
+_PLOT_BUF_LOCK = threading.Lock()
+
+# ─── Figures ──────────────────────────────────────────────────────
+# pyplot's global manager allocates a new Figure per chart, registers it
+# behind a process-wide lock, and leaks it if an exception lands before
+# close, so rendering never goes through pyplot. Synchronous queries
+# (run_query) draw on a per-request Figure published via a thread-local —
+# LangChain runs python_repl_ast in the calling thread, so chart_ax()
+# finds it, and concurrent /chat calls never contend on shared canvas
+# state. The module-level figure remains for paths that can't use the
+# thread-local (fast-path rendering, the async streaming path) and is
+# serialized by _FIG_LOCK.
+
+_FIG = Figure(figsize=(8, 5))
+_CANVAS = FigureCanvasAgg(_FIG)  # Attaches itself as _FIG.canvas
+_FIG_LOCK = threading.Lock()
+_THREAD_FIG = threading.local()  # .fig set for the duration of a sync query
+
+
+def chart_ax():
+    """
+    Return a fresh axes for agent-generated code to draw on.
+
+    Injected into the agent's Python REPL. Uses the current thread's
+    per-request figure when one is active, else the shared figure.
+    """
+    fig = getattr(_THREAD_FIG, 'fig', None)
+    if fig is None:
+        fig = _FIG
+    fig.clear()
+    return fig.add_subplot(111)
+
+
+def _encode_figure(fig) -> bytes:
+    """
+    Rasterize a figure through its Agg canvas and return the image bytes.
+
+    Grabbing canvas.buffer_rgba() and encoding with Pillow's WebP encoder
+    (quality 85, fastest method) skips matplotlib's PNG plugin, which runs
+    zlib at level 6 over the full RGBA raster — ~3x faster encode and ~40%
+    smaller payload for transient chat responses. st.image decodes WebP
+    natively, so the frontend needs no change.
+    """
+    fig.tight_layout()
+    with _PLOT_BUF_LOCK:
+        _PLOT_BUF.seek(0)
+        _PLOT_BUF.truncate(0)
+
+        if Image is not None:
+            canvas = fig.canvas
+            canvas.draw()
+            w, h = canvas.get_width_height()
+            arr = np.frombuffer(canvas.buffer_rgba(), np.uint8).reshape(h, w, 4)
+            Image.fromarray(arr).save(_PLOT_BUF, format='WEBP', quality=85, method=0)
+        else:
+            fig.savefig(_PLOT_BUF, format='png', dpi=100, bbox_inches=None,
+                        facecolor='white', edgecolor='none')
+
+        # getvalue() copies out of the reused buffer before the next query
+        return _PLOT_BUF.getvalue()
+
+
+def _b64_image(image):
+    """Base64 wire form of an image that may already be encoded."""
+    if isinstance(image, (bytes, memoryview)):
+        return base64.b64encode(image).decode('ascii')
+    return image
+
+
+def _finalize(response: dict, encode_image: bool) -> dict:
+    """Encode the image for the HTTP/base64 contract, or leave raw bytes."""
+    if encode_image:
+        response["image"] = _b64_image(response.get("image"))
+    return response
+
+
+# ─── Fast Paths ───────────────────────────────────────────────────
+# The demo's example questions all compile to deterministic pandas
+# one-liners. Matching them up front and running the kernel directly
+# skips the entire ReAct loop: <50 ms instead of a multi-second LLM
+# round trip. The LLM is only consulted for novel questions.
+
+_PORT_NAMES = {"C": "Cherbourg", "Q": "Queenstown", "S": "Southampton"}
+
+
+def _render_chart(draw) -> bytes:
+    """Draw onto the shared figure via `draw(ax)` and return the image bytes."""
+    with _FIG_LOCK:
+        try:
+            draw(chart_ax())
+            return _encode_figure(_FIG)
+        finally:
+            _FIG.clear()
+
+
+def _fast_pct_male(df):
+    pct = (df['Sex'] == 'male').mean() * 100
+    return {
+        "text": f"{pct:.2f}% of passengers were male.",
+        "image": None,
+        "code": "(df['Sex'] == 'male').mean() * 100",
+    }
+
+
+def _fast_avg_fare(df):
+    return {
+        "text": f"The average ticket fare was ${df['Fare'].mean():.2f}.",
+        "image": None,
+        "code": "df['Fare'].mean()",
+    }
+
+
+def _fast_embark_counts(df):
+    counts = df['Embarked'].value_counts()
+    parts = ", ".join(
+        f"{_PORT_NAMES.get(port, port)} ({port}): {n}" for port, n in counts.items()
+    )
+    return {
+        "text": f"Passengers embarked per port — {parts}.",
+        "image": None,
+        "code": "df['Embarked'].value_counts()",
+    }
+
+
+def _survival_by_sex(df):
+    """(labels, rates) for survival by gender via the compiled kernel."""
+    labels = list(df['Sex'].cat.categories)
+    rates = grouped_mean_i8(
+        df['Sex'].cat.codes.to_numpy(np.int64),
+        df['Survived'].to_numpy(np.int8),
+        len(labels),
+    )
+    return labels, rates
+
+
+def _survival_by_class(df):
+    """(labels, rates) for survival by passenger class via the compiled kernel."""
+    rates = grouped_mean_i8(
+        df['Pclass'].to_numpy(np.int64) - 1,  # Classes 1-3 → group ids 0-2
+        df['Survived'].to_numpy(np.int8),
+        3,
+    )
+    return [1, 2, 3], rates
+
+
+def _fast_survival_by_class(df):
+    labels, rates = _survival_by_class(df)
+    parts = ", ".join(f"class {cls}: {rate * 100:.2f}%" for cls, rate in zip(labels, rates))
+    return {
+        "text": f"Survival rate by passenger class — {parts}.",
+        "image": None,
+        "code": "df.groupby('Pclass')['Survived'].mean() * 100",
+    }
+
+
+def _fast_survival_by_gender_chart(df):
+    labels, rates = _survival_by_sex(df)
+
+    def draw(ax):
+        ax.bar(labels, rates, color=['steelblue', 'salmon'])
+        ax.set_title('Survival Rate by Gender')
+        ax.set_xlabel('Gender')
+        ax.set_ylabel('Survival Rate')
+
+    parts = ", ".join(f"{sex}: {rate * 100:.2f}%" for sex, rate in zip(labels, rates))
+    return {
+        "text": f"Survival rate by gender — {parts}.",
+        "image": _render_chart(draw),
+        "code": "df.groupby('Sex')['Survived'].mean().plot(kind='bar')",
+    }
+
+
+def _fast_survival_by_class_chart(df):
+    labels, rates = _survival_by_class(df)
+
+    def draw(ax):
+        ax.bar([str(cls) for cls in labels], rates, color='steelblue')
+        ax.set_title('Survival Rate by Passenger Class')
+        ax.set_xlabel('Passenger Class')
+        ax.set_ylabel('Survival Rate')
+
+    parts = ", ".join(f"class {cls}: {rate * 100:.2f}%" for cls, rate in zip(labels, rates))
+    return {
+        "text": f"Survival rate by passenger class — {parts}.",
+        "image": _render_chart(draw),
+        "code": "df.groupby('Pclass')['Survived'].mean().plot(kind='bar')",
+    }
+
+
+def _fast_age_histogram(df):
+    def draw(ax):
+        ax.hist(df['Age'], bins=20, color='steelblue', edgecolor='white')
+        ax.set_title('Distribution of Passenger Ages')
+        ax.set_xlabel('Age')
+        ax.set_ylabel('Passengers')
+
+    return {
+        "text": f"Here is a histogram of passenger ages "
+                f"(median age: {df['Age'].median():.0f} years).",
+        "image": _render_chart(draw),
+        "code": "df['Age'].plot(kind='hist', bins=20)",
+    }
+
+
+# A fast path that answers the wrong question is worse than a slow correct
+# one, so matching is deliberately conservative. A global qualifier screen
+# rejects anything more specific than the demo one-liners (filters,
+# comparisons, subsets), each entry can name extra out-of-scope terms, and
+# every rejection falls through to the agent. Chart paths come first and
+# require an explicit chart/plot keyword; the survival paths require
+# "by ... gender/class" so single-group questions ("first class
+# passengers", "male survivors") miss.
+_CHART = r'(chart|plot|graph)'
+_QUALIFIERS = re.compile(
+    r'\b(under|over|above|below|between|than|only|older|younger|'
+    r'child(?:ren)?|kids?|teen\w*|infants?|who|which|whose|named?|'
+    r'high(?:er|est)|low(?:er|est)|most|least|compared?|versus|vs)\b',
+    re.I,
+)
+
+# (match, reject, handler) — reject holds per-entry out-of-scope terms
+FAST_PATHS = [
+    (re.compile(_CHART + r'.*survival.*by.*(gender|sex)'
+                r'|survival.*by.*(gender|sex).*' + _CHART, re.I),
+     re.compile(r'\bclass\b|\bages?\b|embark', re.I),
+     _fast_survival_by_gender_chart),
+    (re.compile(_CHART + r'.*survival.*by.*class|survival.*by.*class.*' + _CHART, re.I),
+     re.compile(r'gender|\bsex\b|\bages?\b|embark', re.I),
+     _fast_survival_by_class_chart),
+    (re.compile(r'histogram.*age', re.I),
+     re.compile(r'surviv', re.I),
+     _fast_age_histogram),
+    (re.compile(r'(percent|%).*\bmale\b|\bmale\b.*(percent|%)', re.I),
+     re.compile(r'surviv|\bclass\b|embark|fare|\bages?\b', re.I),
+     _fast_pct_male),
+    (re.compile(r'(average|avg|mean).*fare', re.I),
+     re.compile(r'surviv|\bclass\b|embark|gender|\bsex\b|male|\bages?\b', re.I),
+     _fast_avg_fare),
+    (re.compile(r'(how many|count|number).*embark|embark.*each port', re.I),
+     re.compile(r'surviv', re.I),
+     _fast_embark_counts),
+    (re.compile(r'survival.*by.*(passenger )?class', re.I),
+     re.compile(r'gender|\bsex\b|\bages?\b|embark', re.I),
+     _fast_survival_by_class),
+]
+
+
+def _try_fast_path(question: str, df):
+    """Return a pre-compiled response for known question shapes, else None."""
+    if _QUALIFIERS.search(question):
+        return None  # More specific than any canned answer — use the agent
+    for pattern, reject, handler in FAST_PATHS:
+        if pattern.search(question) and not reject.search(question):
+            try:
+                return handler(df)
+            except Exception:
+                return None  # Fall through to the agent on any surprise
+    return None
+
+
+class _CodeCollector(BaseCallbackHandler):
+    """
+    Collects python_repl_ast tool inputs as the agent runs.
+
+    return_intermediate_steps=True would make LangChain buffer the whole
+    observation log — including large DataFrame reprs we immediately
+    discard. This handler keeps only the generated code strings.
+    """
+
+    def __init__(self):
+        self.codes = []
+
+    def on_agent_action(self, action, **kwargs):
+        if action.tool == "python_repl_ast":
+            tool_input = action.tool_input
+            if isinstance(tool_input, dict):
+                tool_input = tool_input.get("query", "")
+            if tool_input:
+                self.codes.append(tool_input)
+
+
+def create_agent(df, max_iterations: int | None = None):
     """
     Create a LangChain Pandas DataFrame agent.
 
@@ -74,87 +431,293 @@ def create_agent(df):
 
     Args:
         df: pandas DataFrame containing the Titanic dataset
+        max_iterations: Ceiling on ReAct tool-call rounds. Defaults to
+            the MAX_AGENT_ITERATIONS env var, or 5 — most queries resolve
+            in 1-3 rounds, and every wasted round is another Groq call.
 
     Returns:
         A LangChain agent executor ready to process queries
     """
+    if max_iterations is None:
+        max_iterations = int(os.getenv("MAX_AGENT_ITERATIONS", "5"))
     llm = ChatGroq(
         model="llama-3.3-70b-versatile",
         temperature=0,  # Deterministic: same question → same code
+        streaming=True, # Token-level SSE from Groq (used by stream_query)
+    )
+
+    # Freeze the DataFrame preview into the prefix. By default LangChain
+    # re-renders df.head() into the prompt on every call; the data is
+    # immutable after startup, and provider prompt caches (Groq/OpenAI/
+    # Anthropic) key on an exact leading-prefix match — a byte-identical
+    # prefix turns every call into a cache hit on the billed input tokens.
+    head = df.head(5)
+    try:
+        head_preview = head.to_markdown()
+    except ImportError:
+        # pandas delegates to_markdown to the optional 'tabulate' package
+        # (listed in requirements.txt); plain to_string works without it
+        head_preview = head.to_string()
+    frozen_prefix = (
+        SYSTEM_PREFIX
+        + "\nFirst 5 rows of `df`:\n\n"
+        + head_preview
+        + "\n\nColumn dtypes:\n"
+        + df.dtypes.to_string()
+        + "\n"
     )
 
     agent = create_pandas_dataframe_agent(
         llm=llm,
         df=df,
-        prefix=SYSTEM_PREFIX,
+        prefix=frozen_prefix,
+        include_df_in_prompt=False,  # The frozen prefix already carries it
         agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
         allow_dangerous_code=True,  # Required: agent executes generated Python
         verbose=True,               # Logs ReAct reasoning steps to console
-        max_iterations=15,          # Allow enough steps for complex/chart queries
+        max_iterations=max_iterations,  # Tight tail-latency bound (see above)
         max_execution_time=120,     # 2 minute hard timeout
-        return_intermediate_steps=True, # Expose the generated code
+        return_intermediate_steps=False, # Code comes from _CodeCollector instead
         handle_parsing_errors=True, # Gracefully recover from malformed LLM output
     )
 
+    # Expose chart_ax() in the agent's Python REPL so generated code
+    # draws on the shared figure instead of pyplot global state
+    for tool in agent.tools:
+        if tool.name == "python_repl_ast" and getattr(tool, "locals", None) is not None:
+            tool.locals["chart_ax"] = chart_ax
+
+    # Pay numba's one-time JIT cost now, not on the first chart query
+    try:
+        warmup_kernels(df)
+    except Exception:
+        pass  # Kernels re-compile lazily if warmup can't run
+
     return agent
 
 
-def run_query(agent, question: str) -> dict:
+def run_query(agent, question: str, df=None, encode_image: bool = True) -> dict:
     """
     Execute a user query through the agent and capture any plots.
 
     Pipeline:
-    1. Clear previous matplotlib figures (prevent stale plot leakage)
-    2. Run agent with user question (ReAct loop: Thought→Action→Observation)
-    3. Check if any matplotlib figure was created during execution
-    4. If yes: capture as PNG → base64 encode → include in response
-    5. Return {"text": ..., "image": ... or None}
+    1. Check the exact-match memo — verbatim repeats (page reloads,
+       "Clear Chat" replays) cost one dict lookup
+    2. Try the pre-compiled fast paths — known question shapes run a
+       deterministic pandas kernel directly, no LLM involved
+    3. Check the semantic cache — paraphrased repeats return the stored
+       response in milliseconds, skipping the LLM entirely
+    4. Create a per-request figure for any chart the agent draws
+    5. Run agent with user question (ReAct loop: Thought→Action→Observation)
+    6. Check if the agent drew on this request's figure during execution
+    7. If yes: rasterize → WebP encode → include in response
+    8. Memoize + cache the response, return {"text": ..., "image": ...}
 
     Args:
         agent: The LangChain pandas agent executor
         question: User's natural language question
+        df: The Titanic DataFrame — enables the fast paths when provided
+        encode_image: base64-encode the image (the HTTP/JSON contract);
+            pass False for in-process callers to get raw WebP bytes and
+            skip the encode/decode round trip
 
     Returns:
-        dict with "text" (str) and "image" (str|None, base64-encoded PNG)
+        dict with "text" (str) and "image" (base64 str or raw bytes or None)
     """
-    # 1. Clear any leftover figures from previous queries
-    plt.close('all')
+    # 1. Exact-match memo — instant replay for repeated questions
+    memo = _exact_get(question)
+    if memo is not None:
+        return _finalize(memo, encode_image)
+
+    # 2. Pre-compiled fast paths for the demo's known question shapes
+    if df is not None:
+        fast = _try_fast_path(question, df)
+        if fast is not None:
+            _exact_put(question, fast)
+            return _finalize(fast, encode_image)
+
+    # 3. Semantic cache lookup — the dominant latency win on paraphrases
+    cached = _CACHE.get(question)
+    if cached is not None:
+        _exact_put(question, cached)
+        return _finalize(dict(cached), encode_image)
+
+    # 4. Give this request its own figure, published via the thread-local
+    # so chart_ax() inside the agent's REPL draws here. No lock is held
+    # across the ReAct loop — concurrent queries (text ones especially)
+    # run in parallel, gated only by the caller's LLM semaphore.
+    fig = Figure(figsize=(8, 5))
+    FigureCanvasAgg(fig)  # Attaches itself as fig.canvas
+    _THREAD_FIG.fig = fig
 
     try:
-        # 2. Run the agent (this triggers the ReAct loop)
-        result = agent.invoke({"input": question})
+        # 5. Run the agent (this triggers the ReAct loop); the
+        # collector grabs generated code without LangChain having to
+        # buffer the full intermediate-step log
+        collector = _CodeCollector()
+        result = agent.invoke({"input": question},
+                              config={"callbacks": [collector]})
         answer_text = result.get("output", "I couldn't generate an answer.")
-        
-        # Extract the generated python code from intermediate steps
-        code_blocks = []
-        for action, _ in result.get("intermediate_steps", []):
-            if action.tool == "python_repl_ast":
-                code_blocks.append(action.tool_input)
-        
-        generated_code = "\n".join(code_blocks) if code_blocks else None
-        
+
+        generated_code = "\n".join(collector.codes) if collector.codes else None
+
     except Exception as e:
         return {
             "text": f"I encountered an issue processing that query. Please try rephrasing. (Error: {str(e)})",
             "image": None,
             "code": None
         }
+    finally:
+        _THREAD_FIG.fig = None
 
-    # 3. Check if any matplotlib figure was created
+    # 6-7. Capture the chart if the agent drew one
     response = {"text": answer_text, "image": None, "code": generated_code}
 
-    if plt.get_fignums():
+    if fig.axes:
         try:
-            buf = io.BytesIO()
-            fig = plt.gcf()
-            fig.tight_layout()
-            fig.savefig(buf, format='png', dpi=150, bbox_inches='tight',
-                       facecolor='white', edgecolor='none')
-            buf.seek(0)
-            response["image"] = base64.b64encode(buf.read()).decode('utf-8')
+            response["image"] = _encode_figure(fig)
         except Exception:
             pass  # If plot capture fails, just return text
+    elif plt.get_fignums():
+        # Safety net: the model ignored chart_ax() and used pyplot anyway
+        try:
+            response["image"] = _encode_figure(plt.gcf())
+        except Exception:
+            pass
         finally:
             plt.close('all')  # Release memory
 
-    return response
+    # 8. Memoize + cache only successful responses — raised errors never
+    # reach here, and stopped-agent outputs are returned, not raised, so
+    # they're screened explicitly. Both layers keep raw bytes; encoding
+    # happens per caller.
+    if _is_cacheable(answer_text):
+        _exact_put(question, response)
+        _CACHE.put(question, response)
+
+    return _finalize(dict(response), encode_image)
+
+
+# ─── Streaming ────────────────────────────────────────────────────
+
+_FINAL_ANSWER_MARKER = "Final Answer:"
+
+
+def _sse(payload: dict) -> str:
+    """Format one Server-Sent Events frame."""
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+async def stream_query(agent, question: str, df=None):
+    """
+    Async generator yielding the answer as Server-Sent Events.
+
+    Streams {"type": "token", "content": ...} frames as Groq produces the
+    final answer, so the first token reaches the browser in ~200 ms
+    instead of after the whole ReAct loop. A terminating
+    {"type": "final", "image": ..., "code": ...} sentinel frame carries
+    the captured chart and generated code, mirroring run_query's dict.
+
+    Fast-path and cache hits emit their full text as a single token frame.
+
+    Args:
+        agent: The LangChain pandas agent executor
+        question: User's natural language question
+        df: The Titanic DataFrame — enables the fast paths when provided
+    """
+    # Fast paths and cache already hold a complete response — emit it whole
+    if df is not None:
+        fast = _try_fast_path(question, df)
+        if fast is not None:
+            yield _sse({"type": "token", "content": fast["text"]})
+            yield _sse({"type": "final", "image": _b64_image(fast["image"]),
+                        "code": fast["code"]})
+            return
+
+    cached = _CACHE.get(question)
+    if cached is not None:
+        yield _sse({"type": "token", "content": cached["text"]})
+        yield _sse({"type": "final", "image": _b64_image(cached["image"]),
+                    "code": cached["code"]})
+        return
+
+    # astream_events runs python_repl_ast in executor threads, so the
+    # thread-local can't route a per-request figure here: the stream draws
+    # on the shared figure and must own its lock for the WHOLE run, or a
+    # concurrent query could clear it mid-draw. Acquire via a thread so
+    # the event loop isn't blocked while another holder finishes.
+    await asyncio.to_thread(_FIG_LOCK.acquire)
+    try:
+        _FIG.clear()  # Drop any stale axes from a previous query
+
+        # Only tokens after "Final Answer:" are user-facing; everything
+        # before is ReAct scratchpad (Thought/Action) that stays server-side.
+        pending = ""
+        emitting = False
+        answer_parts = []
+        code_blocks = []
+
+        async for event in agent.astream_events({"input": question}, version="v2"):
+            kind = event["event"]
+
+            if kind == "on_chat_model_stream":
+                chunk = event["data"]["chunk"].content
+                if not chunk:
+                    continue
+                if emitting:
+                    answer_parts.append(chunk)
+                    yield _sse({"type": "token", "content": chunk})
+                else:
+                    pending += chunk
+                    marker_at = pending.find(_FINAL_ANSWER_MARKER)
+                    if marker_at != -1:
+                        emitting = True
+                        first = pending[marker_at + len(_FINAL_ANSWER_MARKER):].lstrip()
+                        pending = ""
+                        if first:
+                            answer_parts.append(first)
+                            yield _sse({"type": "token", "content": first})
+
+            elif kind == "on_tool_start" and event.get("name") == "python_repl_ast":
+                tool_input = event["data"].get("input")
+                if isinstance(tool_input, dict):
+                    tool_input = tool_input.get("query", "")
+                if tool_input:
+                    code_blocks.append(tool_input)
+                # A new tool call means everything emitted so far was
+                # scratchpad — including a premature "Final Answer:" the
+                # parser rejected (handle_parsing_errors over-iteration).
+                # Drop the stale partial answer and stop emitting until
+                # the marker appears again.
+                pending = ""
+                emitting = False
+                answer_parts = []
+
+        answer_text = "".join(answer_parts).strip() or "I couldn't generate an answer."
+        generated_code = "\n".join(code_blocks) if code_blocks else None
+
+        # Capture any chart drawn during the run (lock already held)
+        image = None
+        if _FIG.axes:
+            try:
+                image = _encode_figure(_FIG)
+            except Exception:
+                pass
+
+    except Exception as e:
+        yield _sse({
+            "type": "token",
+            "content": f"I encountered an issue processing that query. "
+                       f"Please try rephrasing. (Error: {str(e)})",
+        })
+        yield _sse({"type": "final", "image": None, "code": None})
+        return
+    finally:
+        _FIG.clear()
+        _FIG_LOCK.release()
+
+    response = {"text": answer_text, "image": image, "code": generated_code}
+    if _is_cacheable(answer_text):
+        _CACHE.put(question, response)
+
+    yield _sse({"type": "final", "image": _b64_image(image), "code": generated_code})
@@ -0,0 +1,69 @@
+"""
+Compiled numeric kernels for the fast paths.
+
+pandas' groupby carries fixed dispatch overhead per call that dwarfs the
+actual arithmetic on a frame this small, and a compiled kernel keeps the
+cost linear if the dataset ever grows. When numba is not installed the
+kernels fall back to pure-NumPy bincount equivalents.
+"""
+
+import numpy as np
+
+# numba is an optional accelerator — degrade gracefully if missing
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ModuleNotFoundError:
+    NUMBA_AVAILABLE = False
+
+
+if NUMBA_AVAILABLE:
+
+    @njit(cache=True, parallel=True)
+    def grouped_mean_i8(keys: np.ndarray, vals: np.ndarray, n_groups: int) -> np.ndarray:
+        """
+        Mean of `vals` for each integer group in `keys` (0..n_groups-1).
+
+        Parallel reduction: prange chunks accumulate into per-chunk
+        sum/count slabs, reduced at the end — no atomics in the hot loop.
+        """
+        n = keys.shape[0]
+        n_chunks = 8
+        sums = np.zeros((n_chunks, n_groups), dtype=np.float64)
+        counts = np.zeros((n_chunks, n_groups), dtype=np.int64)
+        chunk = (n + n_chunks - 1) // n_chunks
+
+        for c in prange(n_chunks):
+            start = c * chunk
+            end = min(start + chunk, n)
+            for i in range(start, end):
+                k = keys[i]
+                sums[c, k] += vals[i]
+                counts[c, k] += 1
+
+        out = np.empty(n_groups, dtype=np.float64)
+        for g in range(n_groups):
+            cnt = counts[:, g].sum()
+            out[g] = sums[:, g].sum() / cnt if cnt else np.nan
+        return out
+
+else:
+
+    def grouped_mean_i8(keys: np.ndarray, vals: np.ndarray, n_groups: int) -> np.ndarray:
+        """NumPy fallback: one bincount pass for sums, one for counts."""
+        sums = np.bincount(keys, weights=vals, minlength=n_groups)
+        counts = np.bincount(keys, minlength=n_groups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums / counts
+
+
+def warmup(df) -> None:
+    """
+    Run each kernel once at startup so the one-time JIT compilation cost
+    is paid during agent creation, not on the first chart query.
+    """
+    grouped_mean_i8(
+        df['Sex'].cat.codes.to_numpy(np.int64),
+        df['Survived'].to_numpy(np.int8),
+        len(df['Sex'].cat.categories),
+    )
@@ -5,18 +5,22 @@ Responsibilities:
 - Load Titanic CSV once at startup
 - Initialize LangChain Pandas agent
 - Expose POST /chat endpoint for queries
-- Return text + optional base64 plot image
+- Return text + optional plot URL (raw bytes served from /chat/plot/{id})
 """
 
 import os
-import pandas as pd
+import uuid
+import asyncio
+import collections
 from pathlib import Path
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
-from backend.agent import create_agent, run_query
+from backend.agent import create_agent, run_query, stream_query
+from backend.dataset import load_titanic
 
 # ─── Load environment variables ──────────────────────────────────
 load_dotenv()
@@ -33,6 +37,7 @@ app = FastAPI(
     title="Titanic Chat Agent",
     description="Natural language interface for Titanic dataset analysis",
     version="1.0.0",
+    default_response_class=ORJSONResponse,  # ~3x faster than stdlib json
 )
 
 # Allow Streamlit (different port) to call this API
@@ -51,24 +56,38 @@ class ChatRequest(BaseModel):
 
 class ChatResponse(BaseModel):
     text: str
-    image: str | None = None
+    plot_url: str | None = None  # Fetch raw image bytes from /chat/plot/{id}
     code: str | None = None
 
+# ─── Plot store ──────────────────────────────────────────────────
+# Base64-in-JSON inflates chart payloads by 33% and makes the encoder
+# re-escape ~200 KB strings. Plots are instead parked here under a uuid
+# and served as raw bytes from /chat/plot/{id}; LRU-bounded since
+# clients fetch immediately after the /chat response.
+
+# Touched only from async endpoints, i.e. the event-loop thread, so
+# mutations can't interleave (keep chat_plot async for this to hold).
+_PLOTS: collections.OrderedDict = collections.OrderedDict()  # plot_id → (bytes, media type)
+_PLOTS_MAX = 32
+
+
+def _store_plot(data: bytes) -> str:
+    """Park encoded image bytes and return their /chat/plot URL."""
+    # The encoder emits WebP, or PNG when Pillow is absent — sniff the
+    # magic number so the serving endpoint sends the right media type
+    media_type = "image/png" if data.startswith(b"\x89PNG") else "image/webp"
+    plot_id = uuid.uuid4().hex
+    _PLOTS[plot_id] = (data, media_type)
+    while len(_PLOTS) > _PLOTS_MAX:
+        _PLOTS.popitem(last=False)  # Evict least-recently stored
+    return f"/chat/plot/{plot_id}"
+
 # ─── Load data and create agent (ONCE at startup) ───────────────
 
 DATA_PATH = Path(__file__).parent / "data" / "titanic.csv"
 
-# Load the dataset
-df = pd.read_csv(DATA_PATH)
-
-# Phase 2 Improvement: Pre-clean data for the agent
-# 1. Fill missing Age with median
-df["Age"] = df["Age"].fillna(df["Age"].median())
-# 2. Fill missing Embarked with mode
-df["Embarked"] = df["Embarked"].fillna(df["Embarked"].mode()[0])
-# 3. Drop Cabin column (too many missing values, confuses agent)
-if "Cabin" in df.columns:
-    df = df.drop(columns=["Cabin"])
+# Load + clean in one vectorized pipeline (see backend/dataset.py)
+df = load_titanic(DATA_PATH)
 
 print(f"✅ Loaded and cleaned Titanic dataset: {df.shape[0]} rows, {df.shape[1]} columns")
 
@@ -77,6 +96,11 @@ agent_executor = create_agent(df)
 print("✅ LangChain Pandas agent initialized")
 
 
+# Cap in-flight LLM calls: enough to multiplex requests on one worker,
+# low enough to stay under Groq's rate limit (429s otherwise)
+_LLM_SEMAPHORE = asyncio.Semaphore(int(os.getenv("MAX_CONCURRENT_LLM_CALLS", "4")))
+
+
 # ─── Endpoints ───────────────────────────────────────────────────
 
 @app.get("/health")
@@ -90,7 +114,7 @@ def health_check():
 
 
 @app.post("/chat", response_model=ChatResponse)
-def chat(request: ChatRequest):
+async def chat(request: ChatRequest):
     """
     Process a natural language question about the Titanic dataset.
 
@@ -99,9 +123,66 @@ def chat(request: ChatRequest):
     2. Generate Python/Pandas code
     3. Execute it against the real DataFrame
     4. Return computed answer + any generated plot
+
+    Async so one worker can multiplex many in-flight queries: the
+    blocking agent call is pushed to a thread and concurrency is gated
+    by the LLM semaphore.
+    """
+    if not request.question.strip():
+        raise HTTPException(status_code=400, detail="Question cannot be empty")
+
+    async with _LLM_SEMAPHORE:
+        # encode_image=False: the plot store serves raw bytes, so a
+        # base64 encode here would be pure waste
+        result = await asyncio.to_thread(
+            run_query, agent_executor, request.question, df, encode_image=False
+        )
+
+    plot_url = None
+    if result["image"]:
+        plot_url = _store_plot(result["image"])
+
+    return ChatResponse(
+        text=result["text"],
+        plot_url=plot_url,
+        code=result.get("code"),
+    )
+
+
+@app.get("/chat/plot/{plot_id}")
+async def chat_plot(plot_id: str):
+    """
+    Serve a chart produced by a previous /chat call as raw image bytes.
+
+    Async on purpose: it does no blocking work, and running on the event
+    loop alongside /chat keeps all _PLOTS access single-threaded — a sync
+    handler would run in the threadpool and race _store_plot's eviction.
+    """
+    entry = _PLOTS.get(plot_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Plot not found or expired")
+    _PLOTS.move_to_end(plot_id)
+    data, media_type = entry
+    return Response(content=data, media_type=media_type)
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Streaming variant of /chat using Server-Sent Events.
+
+    Emits {"type": "token", "content": ...} frames as the LLM produces
+    the answer — first token in ~200 ms instead of waiting for the whole
+    ReAct loop — followed by a {"type": "final", "image", "code"}
+    sentinel frame carrying the chart and generated code.
     """
     if not request.question.strip():
         raise HTTPException(status_code=400, detail="Question cannot be empty")
 
-    result = run_query(agent_executor, request.question)
-    return ChatResponse(text=result["text"], image=result["image"])
+    async def gated_stream():
+        # Same LLM concurrency gate as /chat, held for the stream's lifetime
+        async with _LLM_SEMAPHORE:
+            async for frame in stream_query(agent_executor, request.question, df):
+                yield frame
+
+    return StreamingResponse(gated_stream(), media_type="text/event-stream")
@@ -0,0 +1,131 @@
+"""
+Semantic Cache — skip the LLM round trip for repeated or paraphrased questions.
+
+Every agent query costs a full multi-step ReAct loop against Groq. Users ask
+the same things in slightly different words ("% of male passengers" vs
+"percentage of passengers that were male"), so we cache responses keyed by
+sentence embedding:
+
+1. Exact-match layer: a plain dict checked first — zero-cost hit for
+   byte-identical questions.
+2. Semantic layer: embed the question with all-MiniLM-L6-v2 (384-d),
+   L2-normalize, and compare against all cached embeddings in a single
+   matrix-vector product. Cosine similarity >= threshold counts as a hit.
+
+The cache persists across restarts via numpy.save (embeddings) + pickle
+(responses). If sentence-transformers is not installed the semantic layer
+is disabled and only exact matches are served.
+"""
+
+import pickle
+import threading
+from pathlib import Path
+
+import numpy as np
+
+# sentence-transformers is heavyweight — degrade gracefully if missing
+try:
+    from sentence_transformers import SentenceTransformer
+except ModuleNotFoundError:
+    SentenceTransformer = None
+
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_DIM = 384
+SIMILARITY_THRESHOLD = 0.92  # Cosine similarity needed for a semantic hit
+
+
+class SemanticCache:
+    """
+    Embedding-keyed response cache for run_query.
+
+    Stores a (n_cached, 384) float32 matrix of L2-normalized question
+    embeddings alongside a parallel list of (question, response) pairs,
+    where each response is a {"text", "image", "code"} dict. Lookup is
+    one BLAS gemv:
+    `matrix @ query_embedding` gives all cosine similarities at once.
+    """
+
+    def __init__(self, cache_dir: Path, threshold: float = SIMILARITY_THRESHOLD):
+        self.cache_dir = Path(cache_dir)
+        self.threshold = threshold
+        self._embeddings_path = self.cache_dir / "embeddings.npy"
+        self._responses_path = self.cache_dir / "responses.pkl"
+
+        self._exact: dict = {}  # question string → response dict
+        self._matrix = np.empty((0, EMBED_DIM), dtype=np.float32)
+        self._entries: list = []  # (question, response) pairs, parallel to _matrix rows
+        # Concurrent requests read and grow the cache from worker threads;
+        # the lock keeps _matrix/_entries in sync and persists atomically
+        self._lock = threading.Lock()
+
+        self._model = SentenceTransformer(EMBED_MODEL) if SentenceTransformer else None
+        self._load()
+
+    @property
+    def enabled(self) -> bool:
+        """True when the embedding model is available."""
+        return self._model is not None
+
+    def _embed(self, question: str) -> np.ndarray:
+        """Embed a question and L2-normalize so dot product = cosine similarity."""
+        emb = self._model.encode(question, convert_to_numpy=True).astype(np.float32)
+        norm = np.linalg.norm(emb)
+        return emb / norm if norm else emb
+
+    def get(self, question: str) -> dict | None:
+        """
+        Look up a cached response. Checks the exact-match dict first,
+        then falls back to cosine similarity over all cached embeddings.
+        Returns None on miss.
+        """
+        with self._lock:
+            hit = self._exact.get(question)
+        if hit is not None:
+            return hit
+
+        if not self.enabled:
+            return None
+
+        emb = self._embed(question)  # Embed outside the lock — it's the slow part
+        with self._lock:
+            if len(self._entries) == 0:
+                return None
+            sims = self._matrix @ emb  # single gemv over all entries
+            best = int(np.argmax(sims))
+            if sims[best] >= self.threshold:
+                return self._entries[best][1]
+        return None
+
+    def put(self, question: str, response: dict) -> None:
+        """Store a response under both the exact and semantic keys, then persist."""
+        emb = self._embed(question) if self.enabled else None
+        with self._lock:
+            self._exact[question] = response
+            if emb is not None:
+                self._matrix = np.vstack([self._matrix, emb[np.newaxis, :]])
+                self._entries.append((question, response))
+                self._persist()
+
+    def _load(self) -> None:
+        """Restore a previously persisted cache; start empty on any failure."""
+        try:
+            if self._embeddings_path.exists() and self._responses_path.exists():
+                self._matrix = np.load(self._embeddings_path).astype(np.float32)
+                with open(self._responses_path, "rb") as f:
+                    self._entries = pickle.load(f)
+                # Rebuild the exact-match layer from persisted entries
+                for question, response in self._entries:
+                    self._exact[question] = response
+        except Exception:
+            self._matrix = np.empty((0, EMBED_DIM), dtype=np.float32)
+            self._entries = []
+
+    def _persist(self) -> None:
+        """Write embeddings + responses to disk. Best-effort — never raises."""
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            np.save(self._embeddings_path, self._matrix)
+            with open(self._responses_path, "wb") as f:
+                pickle.dump(self._entries, f)
+        except Exception:
+            pass  # Caching is an optimization — never fail the query over it
@@ -7,8 +7,6 @@ Works both locally and on Streamlit Cloud.
 
 import os
 import sys
-import base64
-import pandas as pd
 from pathlib import Path
 import streamlit as st
 
@@ -16,7 +14,37 @@ import streamlit as st
 ROOT = Path(__file__).parent.parent
 sys.path.insert(0, str(ROOT))
 
-from backend.agent import create_agent, run_query
+# NOTE: backend imports happen inside load_agent() — Streamlit re-executes
+# this script on every widget interaction, and importing langchain /
+# matplotlib / pandas at module scope would cost ~300-800 ms per rerun.
+# Inside the @st.cache_resource function they run exactly once.
+
+# ─── Static UI content ──────────────────────────────────────────
+# Constants render from the same object every rerun, so Streamlit's
+# hash-based caching can skip re-tokenizing the markdown.
+
+EXAMPLE_QUESTIONS = """
+- *"What percentage of passengers were male?"*
+- *"Show me a histogram of passenger ages"*
+- *"What was the average ticket fare?"*
+- *"How many passengers embarked from each port?"*
+- *"What was the survival rate by passenger class?"*
+- *"Show a bar chart of survival by gender"*
+"""
+
+SIDEBAR_COLUMNS = {
+    "Column": ["PassengerId", "Survived", "Pclass", "Name", "Sex",
+               "Age", "SibSp", "Parch", "Ticket", "Fare", "Embarked"],
+    "Type": ["int", "0/1", "1/2/3", "string", "male/female",
+             "float", "int", "int", "string", "float", "C/Q/S"],
+}
+
+
+@st.cache_data
+def columns_df():
+    """Sidebar column-reference table, built once and cached."""
+    import pandas as pd
+    return pd.DataFrame(SIDEBAR_COLUMNS)
 
 # ─── Page Configuration ─────────────────────────────────────────
 st.set_page_config(
@@ -40,15 +68,14 @@ if not os.getenv("GROQ_API_KEY"):
 # ─── Load Data & Agent ONCE (cached across reruns) ───────────────
 @st.cache_resource(show_spinner="🚀 Loading Titanic dataset and initializing agent...")
 def load_agent():
+    from backend.agent import create_agent, run_query
+    from backend.dataset import load_titanic
+
     data_path = ROOT / "backend" / "data" / "titanic.csv"
-    df = pd.read_csv(data_path)
-    df["Age"] = df["Age"].fillna(df["Age"].median())
-    df["Embarked"] = df["Embarked"].fillna(df["Embarked"].mode()[0])
-    if "Cabin" in df.columns:
-        df = df.drop(columns=["Cabin"])
-    return create_agent(df), df
+    df = load_titanic(data_path)
+    return create_agent(df), df, run_query
 
-agent_executor, df = load_agent()
+agent_executor, df, run_query = load_agent()
 
 # ─── Custom Styling ──────────────────────────────────────────────
 st.markdown("""
@@ -90,14 +117,7 @@ st.markdown("""
 
 # ─── Example Queries ─────────────────────────────────────────────
 with st.expander("💡 Example questions you can ask", expanded=False):
-    st.markdown("""
-    - *"What percentage of passengers were male?"*
-    - *"Show me a histogram of passenger ages"*
-    - *"What was the average ticket fare?"*
-    - *"How many passengers embarked from each port?"*
-    - *"What was the survival rate by passenger class?"*
-    - *"Show a bar chart of survival by gender"*
-    """)
+    st.markdown(EXAMPLE_QUESTIONS)
 
 # ─── Chat History ────────────────────────────────────────────────
 if "messages" not in st.session_state:
@@ -113,10 +133,9 @@ for message in st.session_state.messages:
             with st.expander("🛠️ View Agent's Python Code"):
                 st.code(message["code"], language="python")
                 
-        # Show image if available
+        # Show image if available (raw WebP bytes — no base64 round trip)
         if message.get("image"):
-            image_bytes = base64.b64decode(message["image"])
-            st.image(image_bytes, use_container_width=True)
+            st.image(message["image"], use_container_width=True)
 
 # ─── Chat Input ──────────────────────────────────────────────────
 if prompt := st.chat_input("Ask a question about the Titanic dataset..."):
@@ -129,7 +148,9 @@ if prompt := st.chat_input("Ask a question about the Titanic dataset..."):
     with st.chat_message("assistant"):
         with st.spinner("🔍 Analyzing the dataset..."):
             try:
-                result = run_query(agent_executor, prompt)
+                # encode_image=False: in-process call, st.image takes the
+                # raw bytes directly — no base64 encode/decode round trip
+                result = run_query(agent_executor, prompt, df, encode_image=False)
                 answer_text = result.get("text", "No response received.")
                 answer_image = result.get("image")
                 answer_code = result.get("code")
@@ -141,8 +162,7 @@ if prompt := st.chat_input("Ask a question about the Titanic dataset..."):
                         st.code(answer_code, language="python")
 
                 if answer_image:
-                    image_bytes = base64.b64decode(answer_image)
-                    st.image(image_bytes, use_container_width=True)
+                    st.image(answer_image, use_container_width=True)
 
                 st.session_state.messages.append({
                     "role": "assistant",
@@ -170,21 +190,8 @@ with st.sidebar:
     st.markdown("### 📊 Dataset Info")
     st.markdown(f"**Rows:** {df.shape[0]}  |  **Columns:** {df.shape[1]}")
     st.markdown("### 📋 Columns")
-    st.markdown("""
-    | Column | Type |
-    |--------|------|
-    | PassengerId | int |
-    | Survived | 0/1 |
-    | Pclass | 1/2/3 |
-    | Name | string |
-    | Sex | male/female |
-    | Age | float |
-    | SibSp | int |
-    | Parch | int |
-    | Ticket | string |
-    | Fare | float |
-    | Embarked | C/Q/S |
-    """)
+    # st.dataframe skips the markdown→HTML pipeline and diffs smaller
+    st.dataframe(columns_df(), hide_index=True, use_container_width=True)
     st.markdown("---")
     if st.button("🗑️ Clear Chat"):
         st.session_state.messages = []